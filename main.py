@@ -1,11 +1,98 @@
 import llm
+import hashlib
+import inspect
+import json
+import os
+import pathlib
+import sys
+import threading
 import time
 import toolbag
 import pprint
-import dataclasses
 
 SYSTEM_PROMPT = "You are a helpful, expert. You have a doctorate in philosophy and software engineering. You develop programming solutions that balance ease of maintenance and robustness. You favor clarity over performance outside of performance critical sections. You use short well-named functions. Avoid large class hierachies. Avoid unnecessary comments in favor of clear self-explained code. Always begin by creating the list of tasks required and then complete each step in order."
 
+# Coalesce streamed chunks so tiny tokens don't each cost a write + flush. Buffered text is
+# written by a timer at most FLUSH_INTERVAL after it arrives, even if the stream then stalls.
+FLUSH_INTERVAL = 0.01
+FLUSH_SIZE = 4096
+
+def stream_chunks(chunks):
+    buf = []
+    size = 0
+    timer = None
+    lock = threading.Lock()
+
+    def flush():
+        nonlocal size, timer
+        with lock:
+            if buf:
+                sys.stdout.write("".join(buf))
+                sys.stdout.flush()
+                buf.clear()
+            size = 0
+            timer = None
+
+    for chunk in chunks:
+        with lock:
+            buf.append(chunk)
+            size += len(chunk)
+            full = size >= FLUSH_SIZE
+            if not full and timer is None:
+                timer = threading.Timer(FLUSH_INTERVAL, flush)
+                timer.daemon = True
+                timer.start()
+        if full:
+            flush()
+    if timer:
+        timer.cancel()
+    flush()
+
+# Set SPROUTING_LLM_CACHE=1 to replay identical runs from disk instead of calling the model.
+# Replays only reprint the output; tools are not called again.
+CACHE_DIR = pathlib.Path(".llm_cache")
+REPLAY_DELAY = 0.02
+
+def cache_enabled():
+    return os.environ.get("SPROUTING_LLM_CACHE") == "1"
+
+def cache_key(model_id, prompt, system, options, tools):
+    payload = {
+        "model_id": model_id,
+        "prompt": prompt,
+        "system": system,
+        "options": options,
+        "tools": [[t.__name__, str(inspect.signature(t)), t.__doc__] for t in tools],
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+def load_cached(key):
+    path = CACHE_DIR / f"{key}.json"
+    return json.loads(path.read_text()) if path.exists() else None
+
+def save_cached(key, responses):
+    CACHE_DIR.mkdir(exist_ok=True)
+    tmp = CACHE_DIR / f"{key}.json.tmp"
+    tmp.write_text(json.dumps(responses))
+    tmp.replace(CACHE_DIR / f"{key}.json")
+
+def recorded(chunks, into):
+    for chunk in chunks:
+        into.append(chunk)
+        yield chunk
+
+def replayed(chunks):
+    for chunk in chunks:
+        yield chunk
+        time.sleep(REPLAY_DELAY)
+
+def replay(responses):
+    for response in responses:
+        stream_chunks(replayed(response["chunks"]))
+        print()
+        print(response["usage"])
+        print()
+
 def before_tool_call(tool, tool_call: llm.ToolCall):
     print(f"About to call tool {tool.name if tool else 'None'} with arguments {tool_call.arguments}")
 
@@ -13,20 +100,41 @@ def after_tool_call(tool: llm.Tool, tool_call: llm.ToolCall, tool_result: llm.To
     print(f"Tool {tool.name} called with arguments {tool_call.arguments} returned {tool_result.output}")
 
 
-def main():
-    m = llm.get_model("qwen3:latest")
-    r = m.chain("Write a python function that fetches the html for a given url using the requests library. Include a concise clear docstring. Save it in an appropriately named file.", system=SYSTEM_PROMPT, options={'temperature': 0.25, 'num_ctx':16384},
-    tools=toolbag.bag.unpack(),
+def run(model_id, prompt, options, tools):
+    m = llm.get_model(model_id)
+    r = m.chain(prompt, system=SYSTEM_PROMPT, options=options,
+    tools=tools,
     after_call=after_tool_call,
     before_call=before_tool_call)
-    start = time.time()
+    responses = []
     for response in r.responses():
-        print(pprint.pprint(dataclasses.asdict(response.prompt)))
-        for chunk in response:
-            print(chunk, end="", flush=True)
+        # pformat walks the dataclass directly; asdict would deep-copy the whole prompt first.
+        print(pprint.pformat(response.prompt))
+        chunks = []
+        stream_chunks(recorded(response, chunks))
+        usage = str(response.usage())
         print()
-        print(response.usage())
+        print(usage)
         print()
+        responses.append({"chunks": chunks, "usage": usage})
+    return responses
+
+
+def main():
+    model_id = "qwen3:latest"
+    prompt = "Write a python function that fetches the html for a given url using the requests library. Include a concise clear docstring. Save it in an appropriately named file."
+    options = {'temperature': 0.25, 'num_ctx':16384}
+    tools = toolbag.bag.unpack()
+    start = time.time()
+    if not cache_enabled():
+        run(model_id, prompt, options, tools)
+    else:
+        key = cache_key(model_id, prompt, SYSTEM_PROMPT, options, tools)
+        cached = load_cached(key)
+        if cached:
+            replay(cached)
+        else:
+            save_cached(key, run(model_id, prompt, options, tools))
     duration = time.time() - start
     human_duration = f"{duration:.0f}s"
     if duration > 60:
@@ -1,9 +1,40 @@
+import asyncio
+import concurrent.futures
+import contextlib
+import functools
+import io
+import itertools
+import mmap
+import os
 import pathlib
 import json
 import re
-
-CWD = pathlib.Path.cwd()
-EXCLUDE_DIRS = {'.', '..', '.git', '__pycache__', 'uv.lock'}
+import time
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+CWD = pathlib.Path.cwd().resolve()
+EXCLUDE_DIRS = frozenset({'.', '..', '.git', '__pycache__', 'uv.lock', '.llm_cache'})
+# Binary formats never worth searching for lines.
+EXCLUDE_SUFFIXES = frozenset({'.pyc', '.so', '.png', '.jpg', '.jpeg', '.gif', '.pdf', '.zip', '.gz'})
+# Files with a NUL byte in this many leading bytes are treated as binary and not searched.
+BINARY_SNIFF_BYTES = 8192
+# Below this many files find_lines_in_all_files searches serially; thread startup isn't worth it.
+PARALLEL_SEARCH_MIN_FILES = 2000
+# Non-empty, relative, and free of NUL bytes. Containment is checked after resolving.
+_SAFE_NAME = re.compile(r'^[^/\x00][^\x00]*$')
+
+# Metadata caches shared across tool calls. Entries expire after _CACHE_TTL seconds
+# and write tools invalidate the paths they touch.
+_CACHE_TTL = 2.0
+_stat_cache: dict[str, tuple[float, os.stat_result]] = {}
+_neg_cache: dict[str, float] = {}
+# list_files JSON, stamped with CWD's mtime. Reused until a write tool marks the tree dirty
+# or entries are added to or removed from CWD.
+_list_files_cache: tuple[int, str] | None = None
+_tree_dirty = True
 
 class Toolbag:
     def __init__(self):
@@ -17,30 +48,188 @@ class Toolbag:
     def unpack(self):
         return list(self.tools.values())
 
+    def precompile(self, patterns):
+        """Warm the compiled regex cache so the first tool call doesn't pay for compilation."""
+        for pattern in patterns:
+            _compile(pattern)
+
 bag = Toolbag()
 
+def dumps(obj):
+    """Serialize a tool result to a compact JSON string."""
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'))
+
 def _filename_to_path(filename):
-    if ('..' in filename) or (filename.startswith('/')):
-        raise Exception(f"FAILURE: {filename} starts with '/' or contains '..' but must be under the current directory.")
-    p = pathlib.Path(CWD / filename)
-    p.parent.mkdir(parents=True, exist_ok=True)
+    if not _SAFE_NAME.match(filename):
+        raise Exception(f"FAILURE: {filename!r} is empty, starts with '/' or contains a NUL byte but must be a path under the current directory.")
+    p = pathlib.Path(os.path.normpath(CWD / filename))
+    resolved = p.resolve()
+    if resolved == CWD or not resolved.is_relative_to(CWD):
+        raise Exception(f"FAILURE: {filename} does not resolve to a path under the current directory.")
+    if not p.parent.is_dir():
+        p.parent.mkdir(parents=True, exist_ok=True)
+        _invalidate(p.parent)
     return p
 
-def _delete_empty_parents(p: pathlib.Path):
-    # For parents of p upto but not including CWD
-    for parent in p.relative_to(CWD).parents[-1]:
-        # If dir is empty
-        if not next(parent.iterdir(), None):
-            parent.rmdir()
-
-def _find_lines_in_file(p, pattern):
-    matches = {}
-    with p.open(mode='rt', encoding='utf-8', errors='ignore') as f:
-        for i, line in enumerate(f, 1):
-            # Check if the line matches the pattern
-            if pattern.search(line):
-                # Store line number as string for cleaner JSON keys
-                matches[str(i)] = line.strip()
+def _cached_stat(path):
+    now = time.monotonic()
+    hit = _stat_cache.get(path)
+    if hit and now - hit[0] < _CACHE_TTL:
+        return hit[1]
+    missed = _neg_cache.get(path)
+    if missed and now - missed < _CACHE_TTL:
+        return None
+    try:
+        st = os.stat(path)
+    except OSError:
+        _neg_cache[path] = now
+        return None
+    _stat_cache[path] = (now, st)
+    _neg_cache.pop(path, None)
+    return st
+
+def _invalidate(p):
+    # Drop cached metadata for p and every dir above it, and mark the list_files snapshot stale.
+    global _tree_dirty
+    _tree_dirty = True
+    path = str(p)
+    while True:
+        _stat_cache.pop(path, None)
+        _neg_cache.pop(path, None)
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+
+@functools.lru_cache(maxsize=512)
+def _get_compiled(pattern_src, flags=0):
+    return re.compile(pattern_src, flags)
+
+def _compile(pattern):
+    # Tools may receive either a raw string (from the model) or an re.Pattern.
+    if isinstance(pattern, re.Pattern):
+        return _get_compiled(pattern.pattern, pattern.flags)
+    return _get_compiled(pattern)
+
+def _delete_empty_parents(p):
+    # Remove empty parents of p up to but not including CWD.
+    # os.rmdir refuses non-empty dirs, which is where the walk stops.
+    cwd = str(CWD)
+    d = os.path.dirname(str(p))
+    while d.startswith(cwd + os.sep):
+        try:
+            os.rmdir(d)
+        except OSError:
+            break
+        d = os.path.dirname(d)
+
+def _line_offsets(data):
+    # Byte offset at which each line starts, plus a final entry for the end of data.
+    offsets = [0]
+    pos = data.find(b'\n')
+    while pos != -1:
+        offsets.append(pos + 1)
+        pos = data.find(b'\n', pos + 1)
+    if offsets[-1] != len(data):
+        offsets.append(len(data))
+    return offsets
+
+def _line_indices(start_line, end_line, total_lines, prefix=''):
+    if start_line < 1 or start_line > total_lines + 1:
+        raise Exception(f"Error: {prefix}start line {start_line} is out of bounds (1 to {total_lines}).")
+    if end_line == -1:
+        return start_line - 1, total_lines
+    if end_line < start_line:
+        raise Exception(f"Error: {prefix}end line ({end_line}) cannot be before {prefix}start line ({start_line}).")
+    if end_line > total_lines:
+        raise Exception(f"Error: {prefix}end line {end_line} exceeds total lines ({total_lines}). Use {prefix}end_line=-1 to go up to end of file.")
+    return start_line - 1, end_line
+
+def _splice_lines(p, start_line, end_line, replacement):
+    data = p.read_bytes()
+    offsets = _line_offsets(data)
+    start_index, end_index = _line_indices(start_line, end_line, len(offsets) - 1)
+    view = memoryview(data)
+    prefix = view[:offsets[start_index]]
+    suffix = view[offsets[end_index]:]
+    with p.open(mode='wb') as f:
+        f.write(prefix)
+        # Keep the spliced lines from running into their neighbours.
+        if prefix and prefix[-1] != 0x0A:
+            f.write(b'\n')
+        f.write(replacement)
+        if replacement and suffix and not replacement.endswith(b'\n'):
+            f.write(b'\n')
+        f.write(suffix)
+    _invalidate(p)
+
+def _map_file(f):
+    # Empty files cannot be mapped, but an empty bytes object reads the same.
+    if os.fstat(f.fileno()).st_size == 0:
+        return contextlib.nullcontext(b'')
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+def _copy_range(src_fd, dest_fd, offset, count):
+    # Copy in the kernel where supported, otherwise through a bounded buffer.
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while count > 0:
+                n = os.copy_file_range(src_fd, dest_fd, count, offset)
+                if n == 0:
+                    return
+                offset += n
+                count -= n
+        except OSError:
+            pass
+    while count > 0:
+        chunk = memoryview(os.pread(src_fd, min(count, 1 << 20), offset))
+        if not chunk:
+            return
+        offset += len(chunk)
+        count -= len(chunk)
+        while chunk:
+            chunk = chunk[os.write(dest_fd, chunk):]
+
+def _copy_to_end(src, src_fd, begin, end, dest, dest_start_line):
+    # Fast paths for copying into a whole file or onto its end. Returns False if neither applies.
+    # A missing dest is left to the splice path, which reports it.
+    if not dest.exists() or os.path.samefile(src, dest):
+        return False
+    if dest_start_line == 1:
+        with dest.open(mode='wb') as f:
+            _copy_range(src_fd, f.fileno(), begin, end - begin)
+        _invalidate(dest)
+        return True
+    with dest.open(mode='r+b') as f:
+        with _map_file(f) as data:
+            total_lines = len(_line_offsets(data)) - 1
+            needs_newline = bool(data) and data[-1] != 0x0A
+        if dest_start_line != total_lines + 1:
+            return False
+        f.seek(0, os.SEEK_END)
+        if needs_newline:
+            f.write(b'\n')
+            f.flush()
+        _copy_range(src_fd, f.fileno(), begin, end - begin)
+    _invalidate(dest)
+    return True
+
+def _find_lines_in_file(path, pattern):
+    # Streams the file decoded the way text mode would (utf-8, universal newlines).
+    # Binary files and files that can't be read, e.g. broken symlinks or ones deleted
+    # mid-walk, have no matches.
+    matches = []
+    try:
+        with open(path, mode='rb') as f:
+            if b'\x00' in f.read(BINARY_SNIFF_BYTES):
+                return None
+            f.seek(0)
+            for i, line in enumerate(io.TextIOWrapper(f, encoding='utf-8', errors='ignore'), 1):
+                # Lines are searched without their newline so patterns can't match across or into it.
+                if pattern.search(line.rstrip('\n')):
+                    matches.append((i, line.strip()))
+    except OSError:
+        return None
 
     return matches if matches else None
 
@@ -50,52 +239,82 @@ def list_files():
 
     Returns JSON nested dictionary representing the directory tree.
     -> {'subdir': {'file1': last_modified_time_epoch}, 'file2': last_modified_time_epoch}"""
-    def recur_dirs(dir):
-        tree = {}
-        for p in sorted(dir.iterdir()):
-            if p.is_dir() and p.name not in EXCLUDE_DIRS:
-                tree[p.name] = recur_dirs(p)
+    global _list_files_cache, _tree_dirty
+    stamp = os.stat(CWD).st_mtime_ns
+    if not _tree_dirty and _list_files_cache and _list_files_cache[0] == stamp:
+        return _list_files_cache[1]
+    _tree_dirty = False
+
+    cwd = str(CWD)
+    tree = {}
+    nodes = {cwd: tree}
+    for dirpath, dirnames, filenames in os.walk(cwd):
+        dirnames[:] = [d for d in dirnames if d not in EXCLUDE_DIRS]
+        subdirs = set(dirnames)
+        node = nodes[dirpath]
+        for name in sorted(dirnames + filenames):
+            path = os.path.join(dirpath, name)
+            if name in subdirs:
+                node[name] = nodes[path] = {}
             else:
-                tree[p.name] = p.c.stat()['st_mtime']
-    tree = recur_dirs(CWD)
-    return json.dumps(tree)
+                st = _cached_stat(path)
+                if st:
+                    node[name] = st.st_mtime
+    _list_files_cache = (stamp, dumps(tree))
+    return _list_files_cache[1]
 
 @bag.tool
 def find_lines_in_file(filename, pattern: re.Pattern):
     """Reads a file and finds lines matching a regex pattern.
 
-    (filename: file to search, pattern: regex pattern) -> JSON dictionary of {line_number (str): line_content (str)}.
+    (filename: file to search, pattern: regex pattern) -> JSON list of [line_number (int), line_content (str)] pairs.
     """
-    patt = pattern.compile()
+    patt = _compile(pattern)
     p = _filename_to_path(filename)
+    if not p.is_file():
+        raise Exception(f"FAILURE: {filename} is not a file.")
     matches = _find_lines_in_file(p, patt)
 
-    return json.dumps(matches if matches else {})
+    return dumps(matches if matches else [])
 
 @bag.tool
 def find_lines_in_all_files(pattern: re.Pattern):
     """Searches all files in current working dir and finds lines matching a regex pattern.
 
-    (pattern: regex pattern) -> JSON: dictionary of {'filename': {line_number (str): line_content (str)}}.
+    (pattern: regex pattern) -> JSON: dictionary of {'filename': [[line_number (int), line_content (str)], ...]}.
     """
-    def recurse_and_search(dir, pattern):
-        results = {}
-        for p in dir.iterdir():
-            if p.is_dir() and p.name not in EXCLUDE_DIRS:
-                matches = recurse_and_search(p, pattern)
-            else:
-                matches = _find_lines_in_file(p, pattern)
-            if matches:
-                results[p.name] = matches
-        if results:
-            return results
-        else:
-            return None
-    patt = pattern.compile()
+    patt = _compile(pattern)
+
+    paths = []
+    cwd = str(CWD)
+    for dirpath, dirnames, filenames in os.walk(cwd):
+        dirnames[:] = [d for d in dirnames if d not in EXCLUDE_DIRS]
+        paths.extend(os.path.join(dirpath, f) for f in filenames
+                     if os.path.splitext(f)[1].lower() not in EXCLUDE_SUFFIXES)
+
+    # re holds the GIL, so threads only overlap the file reads. That is a loss on small
+    # trees and single-CPU machines, where the files are searched in order instead.
+    def search(path):
+        return _find_lines_in_file(path, patt)
+
+    cpus = os.cpu_count() or 1
+    if cpus > 1 and len(paths) >= PARALLEL_SEARCH_MIN_FILES:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=cpus) as pool:
+            found = list(pool.map(search, paths))
+    else:
+        found = list(map(search, paths))
 
-    matches = recurse_and_search(CWD, patt)
+    matches = {}
+    for path, file_matches in zip(paths, found):
+        if not file_matches:
+            continue
+        *dirs, name = path[len(cwd) + 1:].split(os.sep)
+        node = matches
+        for d in dirs:
+            node = node.setdefault(d, {})
+        node[name] = file_matches
 
-    return json.dumps(matches if matches else {})
+    return dumps(matches)
 
 @bag.tool
 def save_to_file(filename, contents):
@@ -106,9 +325,11 @@ def save_to_file(filename, contents):
     File is assumed to be located under the current working directory.
     Overwrites file if it exists already.
     Creates parent dirs if they do not already exist."""
-    with(_filename_to_path(filename).open(mode="wt")) as f:
+    p = _filename_to_path(filename)
+    with(p.open(mode="wt")) as f:
         f.write(contents)
-    return json.dumps({"success": f"Content written to {filename}"})
+    _invalidate(p)
+    return dumps({"success": f"Content written to {filename}"})
 
 @bag.tool
 def read_line_numbers(filename, start_line=1, end_line=-1):
@@ -119,15 +340,12 @@ def read_line_numbers(filename, start_line=1, end_line=-1):
     Set end_line=-1 (the default) to return through end of file."""
     start_line = int(start_line)
     end_line = int(end_line)
+    start_line = max(start_line, 1)
     p = _filename_to_path(filename)
-    data = {}
     with p.open(mode='rt') as f:
-        for line_number, line in enumerate(f, start=1):
-            if end_line > 0 and line_number > end_line:
-                break
-            if line_number >= start_line:
-                data[str(line_number)] = line.rstrip('\n')
-    return json.dumps(data)
+        lines = itertools.islice(f, start_line - 1, end_line if end_line > 0 else None)
+        data = {str(line_number): line.rstrip('\n') for line_number, line in enumerate(lines, start=start_line)}
+    return dumps(data)
 
 @bag.tool
 def copy_lines(src_filename, src_start_line, src_end_line, dest_filename, dest_start_line, dest_end_line):
@@ -142,24 +360,15 @@ def copy_lines(src_filename, src_start_line, src_end_line, dest_filename, dest_s
         dest_end_line: int, > start, <= total_lines, may be -1 to indicate replace through end of file
     """
     src_start_line, src_end_line, dest_start_line, dest_end_line = int(src_start_line), int(src_end_line), int(dest_start_line), int(dest_end_line)
-    p = _filename_to_path(src_filename)
-    with p.open(mode='rt') as f:
-        lines = f.readlines()
-
-    if src_start_line < 1 or src_start_line > len(lines) + 1:
-        raise Exception(f"Error: src_start line {src_start_line} is out of bounds (1 to {len(lines)}).")
-
-    start_index = src_start_line - 1
-    if src_end_line == -1:
-        end_index = len(lines)
-    else:
-        end_index = src_end_line
-
-    if src_end_line < src_start_line:
-        raise Exception(f"Error: src_end line ({src_end_line}) cannot be before start line ({src_start_line}).")
-    if src_end_line > len(lines):
-        raise Exception(f"Error: src_end line {src_end_line} exceeds total lines ({len(lines)}). Use end_line=-1 to copy up to end of file.")
-    replace_lines_in_file(dest_filename, dest_start_line, dest_end_line, lines[start_index:end_index])
+    src = _filename_to_path(src_filename)
+    dest = _filename_to_path(dest_filename)
+    with src.open(mode='rb') as f, _map_file(f) as data:
+        offsets = _line_offsets(data)
+        start_index, end_index = _line_indices(src_start_line, src_end_line, len(offsets) - 1, prefix='src_')
+        begin, end = offsets[start_index], offsets[end_index]
+        if dest_end_line != -1 or not _copy_to_end(src, f.fileno(), begin, end, dest, dest_start_line):
+            _splice_lines(dest, dest_start_line, dest_end_line, data[begin:end])
+    return dumps({"success": f"Copied lines {src_start_line}:{src_end_line} of {src_filename} to lines {dest_start_line}:{dest_end_line} of {dest_filename}"})
 
 @bag.tool
 def replace_lines_in_file(filename, start_line, end_line, replacement_contents):
@@ -168,30 +377,10 @@ def replace_lines_in_file(filename, start_line, end_line, replacement_contents):
     If end_line is -1, replace from start_line to the end of the file.
     Lines can be deleted from a file by passing an empty string as replacement_contents
     """
+    start_line, end_line = int(start_line), int(end_line)
     p = _filename_to_path(filename)
-    with p.open(mode='rt') as f:
-        lines = f.readlines()
-
-    if start_line < 1 or start_line > len(lines) + 1:
-        raise Exception(f"Error: Start line {start_line} is out of bounds (1 to {len(lines)}).")
-
-    start_index = start_line - 1
-    if end_line == -1:
-        end_index = len(lines)
-    else:
-        end_index = end_line
-
-    if end_line < start_line:
-        raise Exception(f"Error: End line ({end_line}) cannot be before start line ({start_line}).")
-    if end_line > len(lines):
-        raise Exception(f"Error: End line {end_line} exceeds total lines ({len(lines)}). Use end_line=-1 to replace up to end of file.")
-
-    with p.open(mode='wt') as f:
-        f.write('\n'.join(lines[:start_index]))
-        if replacement_contents:
-            f.write(replacement_contents)
-        f.write('\n'.join(lines[end_index:]))
-    return json.dumps({"success": f"Replaced lines {start_line}:{end_line} in {filename}"})
+    _splice_lines(p, start_line, end_line, (replacement_contents or '').encode('utf-8'))
+    return dumps({"success": f"Replaced lines {start_line}:{end_line} in {filename}"})
 
 @bag.tool
 def delete_file(filename):
@@ -199,9 +388,11 @@ def delete_file(filename):
 
     (filename) -> success/failure.
     File is assumed to be located under the current working directory."""
-    p = _filename_to_path(filename).unlink()
+    p = _filename_to_path(filename)
+    os.unlink(p)
+    _invalidate(p)
     _delete_empty_parents(p)
-    return json.dumps({"success": f"Deleted {filename} and any empty parent dirs."})
+    return dumps({"success": f"Deleted {filename} and any empty parent dirs."})
 
 @bag.tool
 def move_file(src_filename, dest_filename):
@@ -211,6 +402,78 @@ def move_file(src_filename, dest_filename):
     Files are assumed to be located under the current working directory."""
     s = _filename_to_path(src_filename)
     d = _filename_to_path(dest_filename)
-    s.rename(d)
+    os.rename(s, d)
+    _invalidate(s)
+    _invalidate(d)
     _delete_empty_parents(s)
-    return json.dumps({"success": f"Renamed {src_filename} to {dest_filename}"})
\ No newline at end of file
+    return dumps({"success": f"Renamed {src_filename} to {dest_filename}"})
+
+# One pooled session so repeat fetches from a host reuse the TCP/TLS connection.
+_session = requests.Session()
+_adapter = HTTPAdapter(pool_maxsize=32, max_retries=2)
+_session.mount('https://', _adapter)
+_session.mount('http://', _adapter)
+
+# url -> (conditional request headers, last body), for pages that sent an ETag or Last-Modified.
+_conditional_cache = {}
+
+def _validators(response):
+    headers = {}
+    if 'ETag' in response.headers:
+        headers['If-None-Match'] = response.headers['ETag']
+    if 'Last-Modified' in response.headers:
+        headers['If-Modified-Since'] = response.headers['Last-Modified']
+    return headers
+
+@bag.tool
+def fetch_html(url):
+    """
+    Fetches the HTML content of a given URL.
+
+    Parameters:
+    url (str): The URL to fetch.
+
+    Returns:
+    str: The HTML content of the page, or an error message if fetching fails.
+    """
+    cached = _conditional_cache.get(url)
+    try:
+        response = _session.get(url, headers=cached[0] if cached else None, timeout=(5, 30))
+        if cached and response.status_code == 304:
+            return cached[1]
+        response.raise_for_status()
+        validators = _validators(response)
+        if validators:
+            _conditional_cache[url] = (validators, response.text)
+        else:
+            _conditional_cache.pop(url, None)
+        return response.text
+    except requests.exceptions.RequestException as e:
+        return f"Error fetching HTML: {str(e)}"
+
+async def _fetch_html_async(client, url):
+    try:
+        response = await client.get(url)
+        response.raise_for_status()
+        return response.text
+    except httpx.HTTPError as e:
+        return f"Error fetching HTML: {str(e)}"
+
+async def _fetch_html_many(urls):
+    limits = httpx.Limits(max_connections=32)
+    timeout = httpx.Timeout(30, connect=5)
+    async with httpx.AsyncClient(limits=limits, timeout=timeout, follow_redirects=True) as client:
+        return await asyncio.gather(*(_fetch_html_async(client, url) for url in urls))
+
+@bag.tool
+def fetch_html_many(urls: list[str]):
+    """
+    Fetches the HTML content of several URLs concurrently.
+
+    Parameters:
+    urls (list[str]): The URLs to fetch.
+
+    Returns:
+    str: JSON list with the HTML content of each page, or an error message for each fetch that fails, in the same order as urls.
+    """
+    return dumps(asyncio.run(_fetch_html_many(urls)))